@@ -1,16 +1,141 @@
-import random
-import itertools
-
 import numpy as np
 import matplotlib.pyplot as plt
 import gym
 from gym import spaces
 from matplotlib import colors
+from numba import njit, prange
 from ray.rllib.env.multi_agent_env import MultiAgentEnv
 
 from . import utils
 
 
+# Grid cell values, as plain integers to be used in JIT-compiled code
+_EMPTY = utils.GridCell.EMPTY.value
+_RESOURCE = utils.GridCell.RESOURCE.value
+_AGENT = utils.GridCell.AGENT.value
+_ORIENTATION = utils.GridCell.ORIENTATION.value
+
+# Action values, as plain integers to be used in JIT-compiled code
+_STEP_FORWARD = utils.AgentAction.STEP_FORWARD.value
+_STEP_LEFT = utils.AgentAction.STEP_LEFT.value
+_TAG = utils.AgentAction.TAG.value
+_GIFT = utils.AgentAction.GIFT.value
+
+# Action lookup tables, as module-level arrays to be used in JIT-compiled code
+_ACTION_DX = utils.ACTION_DX
+_ACTION_DY = utils.ACTION_DY
+_ACTION_DO = utils.ACTION_DO
+
+
+@njit(cache=True)
+def _mark_orientation_kernel(grid, x, y, o, remove):
+    """
+    Mark (or unmark) the cell in front of the agent at (x, y, o) in the grid
+    """
+    height, width = grid.shape
+    x, y = x + _ACTION_DX[o, _STEP_FORWARD], y + _ACTION_DY[o, _STEP_FORWARD]
+    if x >= 0 and x < width and y >= 0 and y < height:
+        if not remove and grid[y, x] == _EMPTY:
+            grid[y, x] = _ORIENTATION
+        elif grid[y, x] == _ORIENTATION:
+            grid[y, x] = _EMPTY
+
+
+@njit(cache=True)
+def _step_kernel(
+    grid, positions, actions, tagging_ability, beam_squares_front, beam_squares_side
+):
+    """
+    Move all agents one after the other (in handle order), by updating
+    the given grid and (x, y, o) positions array in-place, and return
+    which agents acted, which agents collected a resource and, for each
+    tagging or gifting agent, which agents were in its beam trajectory
+    """
+    n_agents = positions.shape[0]
+    height, width = grid.shape
+    acted = np.zeros(n_agents, dtype=np.bool_)
+    collected = np.zeros(n_agents, dtype=np.bool_)
+    tagged = np.zeros(n_agents, dtype=np.bool_)
+    beams = np.zeros((n_agents, n_agents), dtype=np.bool_)
+    for h in range(n_agents):
+        # Agents tagged in the current step cannot act
+        if tagged[h]:
+            continue
+        acted[h] = True
+
+        # Compute new position
+        x, y, o, action = positions[h, 0], positions[h, 1], positions[h, 2], actions[h]
+        dx, dy = _ACTION_DX[o, action], _ACTION_DY[o, action]
+        nx, ny, no = x + dx, y + dy, (o + _ACTION_DO[o, action]) % 4
+
+        # If move is not feasible the agent stands still
+        if (
+            nx < 0
+            or nx >= width
+            or ny < 0
+            or ny >= height
+            or (grid[ny, nx] == _AGENT and (dx != 0 or dy != 0))
+        ):
+            nx, ny, no = x, y, o
+
+        # Check for resource presence and then move the agent
+        collected[h] = grid[ny, nx] == _RESOURCE
+        grid[y, x] = _EMPTY
+        _mark_orientation_kernel(grid, x, y, o, True)
+        grid[ny, nx] = _AGENT
+        _mark_orientation_kernel(grid, nx, ny, no, False)
+        positions[h, 0], positions[h, 1], positions[h, 2] = nx, ny, no
+
+        # Find agents in the beam trajectory, expressing other agents'
+        # coordinates as (forward, lateral) distances from the current agent
+        if action == _TAG or action == _GIFT:
+            fx, fy = _ACTION_DX[no, _STEP_FORWARD], _ACTION_DY[no, _STEP_FORWARD]
+            lx, ly = _ACTION_DX[no, _STEP_LEFT], _ACTION_DY[no, _STEP_LEFT]
+            for g in range(n_agents):
+                if g != h:
+                    dx, dy = positions[g, 0] - nx, positions[g, 1] - ny
+                    front, side = dx * fx + dy * fy, dx * lx + dy * ly
+                    beams[h, g] = (
+                        front >= 0
+                        and front < beam_squares_front
+                        and abs(side) <= beam_squares_side
+                    )
+            if tagging_ability and action == _TAG:
+                tagged |= beams[h]
+
+    return acted, collected, beams
+
+
+@njit(parallel=True, cache=True)
+def _ball_counts_kernel(grid, candidates, ball_kernel):
+    """
+    Count the number of resources in a ball centered around each
+    candidate location of the grid, where the ball is given as a binary
+    kernel (counts of non-candidate locations are left to zero)
+    """
+    height, width = grid.shape
+    radius = ball_kernel.shape[0] // 2
+    counts = np.zeros((height, width), dtype=np.int32)
+    for y in prange(height):
+        for x in range(width):
+            if not candidates[y, x]:
+                continue
+            count = 0
+            for ky in range(
+                max(0, radius - y), min(2 * radius + 1, height + radius - y)
+            ):
+                for kx in range(
+                    max(0, radius - x), min(2 * radius + 1, width + radius - x)
+                ):
+                    if (
+                        ball_kernel[ky, kx]
+                        and grid[y + ky - radius, x + kx - radius] == _RESOURCE
+                    ):
+                        count += 1
+            counts[y, x] = count
+    return counts
+
+
 class CPRGridEnv(MultiAgentEnv, gym.Env):
     """
     Defines the CPR appropriation (Harvest) Gym environment as described in the paper
@@ -38,6 +163,13 @@ class CPRGridEnv(MultiAgentEnv, gym.Env):
         utils.GridCell.values() + [utils.GridCell.size()], utils.GridCell.size()
     )
 
+    # RGB colors of grid cells, indexed by cell value (shifted so as to start
+    # from zero), to be used when converting the grid to observations
+    OBSERVATION_PALETTE = np.array(
+        [colors.to_rgb(c) for c in GRID_CELL_COLORS.values()], dtype=np.float32
+    )
+    FOV_OWN_AGENT_RGB = np.array(colors.to_rgb(FOV_OWN_AGENT_COLOR), dtype=np.float32)
+
     # Rendering option
     FIGSIZE = (12, 10)
 
@@ -100,6 +232,24 @@ class CPRGridEnv(MultiAgentEnv, gym.Env):
         self.gifting_fixed_budget_size = gifting_fixed_budget_size
         self.add_social_outcome_metrics = add_social_outcome_metrics
 
+        # Disc-shaped kernel used to count resources in a ball around each cell
+        # (see https://stackoverflow.com/questions/8647024/how-to-apply-a-disc-shaped-mask-to-a-numpy-array)
+        yg, xg = np.ogrid[
+            -self.ball_radius : self.ball_radius + 1,
+            -self.ball_radius : self.ball_radius + 1,
+        ]
+        self._ball_kernel = (xg ** 2 + yg ** 2 <= self.ball_radius ** 2).astype(
+            np.int32
+        )
+
+        # Offsets of each FOV cell w.r.t. the agent's position, for each orientation
+        if not self.global_obs:
+            (
+                self._fov_dys,
+                self._fov_dxs,
+                self._fov_agent_cells,
+            ) = self._get_fov_offsets()
+
         # Gym requirements
         self.action_space = utils.CPRGridActionSpace()
         self.observation_space = spaces.Box(
@@ -115,18 +265,44 @@ class CPRGridEnv(MultiAgentEnv, gym.Env):
             dtype=np.float32,
         )
 
+        # Buffers for the dynamic state of agents and grid,
+        # that are re-used across episodes (grid cells are stored
+        # as int8, since their values lie in [-1, 3])
+        self._positions = np.empty((self.n_agents, 3), dtype=np.int32)
+        self._initial_grid = np.empty(
+            (self.grid_height, self.grid_width), dtype=np.int8
+        )
+        self.grid = np.empty_like(self._initial_grid)
+
+        # Copy of the grid surrounded by a border of outside cells, wide enough
+        # to contain any FOV, so that FOVs can be gathered without bounds checks
+        if not self.global_obs:
+            self._fov_padding = max(
+                np.abs(self._fov_dys).max(), np.abs(self._fov_dxs).max()
+            )
+            self._padded_grid = np.full(
+                (
+                    self.grid_height + 2 * self._fov_padding,
+                    self.grid_width + 2 * self._fov_padding,
+                ),
+                utils.GridCell.OUTSIDE.value,
+                dtype=self.grid.dtype,
+            )
+
+        # Random number generator, created either when seeding the
+        # environment or from NumPy's global random state at the first reset
+        self._rng = None
+
         # Dynamic variables
         (
             self.elapsed_steps,
-            self.agent_positions,
-            self._initial_grid,
-            self.grid,
+            self._n_resources,
             self.tagged_agents,
             self.tagging_history,
             self.rewards_history,
             self.collected_resources,
             self.gifting_budget,
-        ) = (None, None, None, None, None, None, None, None, None)
+        ) = (None, None, None, None, None, None, None)
 
     def observation_space_size(self, flattened=True):
         """
@@ -151,16 +327,50 @@ class CPRGridEnv(MultiAgentEnv, gym.Env):
         """
         return utils.AgentAction.STAND_STILL.value
 
+    @property
+    def agent_positions(self):
+        """
+        Return the list of agent positions, as AgentPosition objects
+        (positions are stored as an array of (x, y, o) triplets)
+        """
+        return [
+            self._get_agent_position(agent_handle)
+            for agent_handle in range(self.n_agents)
+        ]
+
+    def _get_agent_position(self, agent_handle):
+        """
+        Return the position of the given agent as an AgentPosition object
+        """
+        x, y, o = self._positions[agent_handle].tolist()
+        return utils.AgentPosition(x=x, y=y, o=utils.AgentOrientation(o))
+
+    def seed(self, seed=None):
+        """
+        Seed the random number generator used by the environment
+        """
+        self._rng = np.random.default_rng(seed)
+        return [seed]
+
     def reset(self):
         """
         Spawns a new environment by assigning random positions to the agents
         and initializing a new 2D grid
         """
+        # Seed the environment from the global random state, if not done yet
+        if self._rng is None:
+            self.seed(np.random.randint(2 ** 32, dtype=np.int64))
+
         # Reset variables
         self.elapsed_steps = 0
-        self.agent_positions = [self._random_position() for _ in range(self.n_agents)]
+        self._positions[:] = self._rng.integers(
+            0,
+            [self.grid_width, self.grid_height, utils.AgentOrientation.size()],
+            size=(self.n_agents, 3),
+        )
         self._initial_grid = self._get_initial_grid()
-        self.grid = self._initial_grid.copy()
+        self.grid[:] = self._initial_grid
+        self._n_resources = np.count_nonzero(self.grid == utils.GridCell.RESOURCE.value)
         self.tagged_agents = dict()
         self.tagging_history = [dict(self.tagged_agents)]
         self.collected_resources = {h: 0 for h in range(self.n_agents)}
@@ -177,71 +387,27 @@ class CPRGridEnv(MultiAgentEnv, gym.Env):
             self.gifting_budget = {h: 0 for h in range(self.n_agents)}
 
         # Compute observations for each agent
-        observations = {h: None for h in range(self.n_agents)}
-        for agent_handle in range(self.n_agents):
-            observations[agent_handle] = self._get_observation(agent_handle)
-
-        return observations
-
-    def _random_position(self):
-        """
-        Returns a random position in the 2D grid
-        """
-        return utils.AgentPosition(
-            x=random.randint(0, self.grid_width - 1),
-            y=random.randint(0, self.grid_height - 1),
-            o=utils.AgentOrientation.random(),
-        )
+        return self._get_observations()
 
     def _get_initial_grid(self):
         """
         Initializes the 2D grid by setting agent positions and
-        initial random resources
+        initial random resources (the grid buffer is filled in-place)
         """
         # Assign agent positions in the grid
-        grid = np.full((self.grid_height, self.grid_width), utils.GridCell.EMPTY.value)
-        for agent_position in self.agent_positions:
-            grid[agent_position.y, agent_position.x] = utils.GridCell.AGENT.value
-            grid = self._mark_orientation(grid, agent_position)
-
-        # Compute initial resources
-        resource_mask = np.random.binomial(
-            1,
-            self.initial_resource_probability,
-            size=(self.grid_height, self.grid_width),
-        ).astype(bool)
-        ys, xs = resource_mask.nonzero()
-        resource_indices = list(zip(list(xs), list(ys)))
-
-        # Assign resources to cells that are not occupied by agents
-        for x, y in resource_indices:
-            if grid[y, x] == utils.GridCell.EMPTY.value:
-                grid[y, x] = utils.GridCell.RESOURCE.value
-
-        return grid
+        grid = self._initial_grid
+        grid.fill(utils.GridCell.EMPTY.value)
+        xs, ys, os = self._positions.T
+        grid[ys, xs] = utils.GridCell.AGENT.value
+        for x, y, o in zip(xs, ys, os):
+            _mark_orientation_kernel(grid, x, y, o, False)
+
+        # Assign initial resources to cells that are not occupied by agents
+        resource_mask = self._rng.random(grid.shape) < self.initial_resource_probability
+        grid[
+            resource_mask & (grid == utils.GridCell.EMPTY.value)
+        ] = utils.GridCell.RESOURCE.value
 
-    def _mark_orientation(self, grid, agent_position, remove=False):
-        """
-        Mark the agent's orientation in the grid
-        """
-        x, y, o = agent_position.x, agent_position.y, agent_position.o
-        if o == utils.AgentOrientation.UP:
-            y -= 1
-        elif o == utils.AgentOrientation.DOWN:
-            y += 1
-        elif o == utils.AgentOrientation.LEFT:
-            x -= 1
-        elif o == utils.AgentOrientation.RIGHT:
-            x += 1
-        if (
-            (x != agent_position.x or y != agent_position.y)
-            and (x >= 0 and x < self.grid_width)
-            and (y >= 0 and y < self.grid_height)
-        ):
-            if not remove and grid[y, x] == utils.GridCell.EMPTY.value:
-                grid[y, x] = utils.GridCell.ORIENTATION.value
-            elif grid[y, x] == utils.GridCell.ORIENTATION.value:
-                grid[y, x] = utils.GridCell.EMPTY.value
         return grid
 
     def get_legal_actions(self, agent_handle):
@@ -249,100 +415,15 @@ class CPRGridEnv(MultiAgentEnv, gym.Env):
         Return a mask to be used to remove illegal actions
         when computing policy probabilities
         """
-        agent_position = self.agent_positions[agent_handle]
-        legal_actions = [True] * utils.AgentAction.size()
-
-        # Disable stepping forward
-        if (
-            (
-                agent_position.o == utils.AgentOrientation.UP.value
-                and agent_position.y == 0
-            )
-            or (
-                agent_position.o == utils.AgentOrientation.DOWN.value
-                and agent_position.y == self.grid_height - 1
-            )
-            or (
-                agent_position.o == utils.AgentOrientation.LEFT.value
-                and agent_position.x == 0
-            )
-            or (
-                (
-                    agent_position.o == utils.AgentOrientation.RIGHT.value
-                    and agent_position.x == self.grid_width - 1
-                )
-            )
-        ):
-            legal_actions[utils.AgentAction.STEP_FORWARD.value] = False
-
-        # Disable stepping backward
-        if (
-            (
-                agent_position.o == utils.AgentOrientation.UP.value
-                and agent_position.y == self.grid_height - 1
-            )
-            or (
-                agent_position.o == utils.AgentOrientation.DOWN.value
-                and agent_position.y == 0
-            )
-            or (
-                agent_position.o == utils.AgentOrientation.LEFT.value
-                and agent_position.x == self.grid_width - 1
-            )
-            or (
-                (
-                    agent_position.o == utils.AgentOrientation.RIGHT.value
-                    and agent_position.x == 0
-                )
-            )
-        ):
-            legal_actions[utils.AgentAction.STEP_BACKWARD.value] = False
-
-        # Disable stepping left
-        if (
-            (
-                agent_position.o == utils.AgentOrientation.UP.value
-                and agent_position.x == 0
-            )
-            or (
-                agent_position.o == utils.AgentOrientation.DOWN.value
-                and agent_position.x == self.grid_width - 1
-            )
-            or (
-                agent_position.o == utils.AgentOrientation.LEFT.value
-                and agent_position.y == self.grid_height - 1
-            )
-            or (
-                (
-                    agent_position.o == utils.AgentOrientation.RIGHT.value
-                    and agent_position.y == 0
-                )
-            )
-        ):
-            legal_actions[utils.AgentAction.STEP_LEFT.value] = False
-
-        # Disable stepping right
-        if (
-            (
-                agent_position.o == utils.AgentOrientation.UP.value
-                and agent_position.x == self.grid_width - 1
-            )
-            or (
-                agent_position.o == utils.AgentOrientation.DOWN.value
-                and agent_position.x == 0
-            )
-            or (
-                agent_position.o == utils.AgentOrientation.LEFT.value
-                and agent_position.y == 0
-            )
-            or (
-                (
-                    agent_position.o == utils.AgentOrientation.RIGHT.value
-                    and agent_position.y == self.grid_height - 1
-                )
-            )
-        ):
-            legal_actions[utils.AgentAction.STEP_RIGHT.value] = False
+        # Disable movements that would take the agent outside of the grid
+        x, y, o = self._positions[agent_handle].tolist()
+        new_xs, new_ys = x + utils.ACTION_DX[o], y + utils.ACTION_DY[o]
+        legal_actions = (
+            (new_xs >= 0)
+            & (new_xs < self.grid_width)
+            & (new_ys >= 0)
+            & (new_ys < self.grid_height)
+        ).tolist()
 
         # Disable tagging when not enabled by the user or when only playing with one agent
         if not self.tagging_ability or self.n_agents == 1:
@@ -368,68 +449,82 @@ class CPRGridEnv(MultiAgentEnv, gym.Env):
             isinstance(action_dict, dict) and len(action_dict) == self.n_agents
         ), "Actions should be given as a dictionary with lenght equal to the number of agents"
 
+        # Move all agents
+        actions = np.array(
+            [action_dict[agent_handle] for agent_handle in range(self.n_agents)],
+            dtype=np.int64,
+        )
+        assert (
+            (actions >= 0) & (actions < utils.AgentAction.size())
+        ).all(), "The given actions should be compatible with AgentAction"
+        acted, collected, beams = _step_kernel(
+            self.grid,
+            self._positions,
+            actions,
+            self.tagging_ability,
+            self.beam_squares_front,
+            self.beam_squares_side,
+        )
+
+        return self._complete_step(actions, acted, collected, beams)
+
+    def _complete_step(self, actions, acted, collected, beams):
+        """
+        Complete a step in the environment after all the agents were moved
+        (see _step_kernel), by assigning rewards, tagging and gifting agents
+        and computing one observation for each agent
+        """
         # Initialize variables
-        observations = {h: None for h in range(self.n_agents)}
         rewards = {h: 0 for h in range(self.n_agents)}
         dones = {h: False for h in range(self.n_agents)}
         infos = {h: dict() for h in range(self.n_agents)}
+        self._n_resources -= np.count_nonzero(collected)
 
-        # Move all agents
+        # Assign rewards and perform tagging and gifting
         tagged_agents, gifting_agents, gifted_agents = [], [], []
-        for agent_handle, action in action_dict.items():
-            # Perform the action only if not previously tagged
-            if (
-                self.tagging_ability and agent_handle not in tagged_agents
-            ) or not self.tagging_ability:
-                # Compute new position
-                new_agent_position = self._compute_new_agent_position(
-                    agent_handle, action
-                )
-
-                # Assign reward for resource collection
-                if self._has_resource(new_agent_position):
-                    self.collected_resources[agent_handle] += 1
-                    rewards[agent_handle] += self.RESOURCE_COLLECTION_REWARD
-
-                # Move the agent only after checking for resource presence
-                self._move_agent(agent_handle, new_agent_position)
-
-                # Tag agents
-                if self.tagging_ability and action == utils.AgentAction.TAG:
-                    tagged_agents += self._agents_in_beam_trajectory(agent_handle)
-
-                # Gift other agents
+        for agent_handle, action in enumerate(actions.tolist()):
+            # Consider only the agents that were not previously tagged
+            if not acted[agent_handle]:
+                continue
+
+            # Assign reward for resource collection
+            if collected[agent_handle]:
+                self.collected_resources[agent_handle] += 1
+                rewards[agent_handle] += self.RESOURCE_COLLECTION_REWARD
+
+            # Tag agents
+            agents_in_beam = np.flatnonzero(beams[agent_handle]).tolist()
+            if self.tagging_ability and action == utils.AgentAction.TAG:
+                tagged_agents += agents_in_beam
+
+            # Gift other agents
+            if self.gifting_mechanism is not None and action == utils.AgentAction.GIFT:
+                # Gift each agent in the beam trajectory equally
+                # (only if we have enough gifting budget left)
+                if self.gifting_budget[agent_handle] > 0:
+                    # Penalize the gifting agent only in the zero-sum case
+                    gifting_agents += [agent_handle]
+                    if self.gifting_mechanism == utils.GiftingMechanism.ZERO_SUM:
+                        rewards[agent_handle] -= self.GIFTING_REWARD
+
+                    # Reduce the gifting budget and send gifts to agents
+                    # in the beam trajectory
+                    self.gifting_budget[agent_handle] -= self.GIFTING_REWARD
+                    gifted_agents += agents_in_beam
+                    for agent_to_gift in agents_in_beam:
+                        rewards[agent_to_gift] += self.GIFTING_REWARD / len(
+                            agents_in_beam
+                        )
+
+                # Replenish the budget by 1 resource after colleting 2 resources
+                # (only if replenishable budget is chosen)
                 if (
-                    self.gifting_mechanism is not None
-                    and action == utils.AgentAction.GIFT
+                    self.gifting_mechanism
+                    == utils.GiftingMechanism.REPLENISHABLE_BUDGET
+                    and self.collected_resources[agent_handle] % 2 == 0
+                    and self.collected_resources[agent_handle] != 0
                 ):
-                    # Gift each agent in the beam trajectory equally
-                    # (only if we have enough gifting budget left)
-                    if self.gifting_budget[agent_handle] > 0:
-                        # Penalize the gifting agent only in the zero-sum case
-                        gifting_agents += [agent_handle]
-                        if self.gifting_mechanism == utils.GiftingMechanism.ZERO_SUM:
-                            rewards[agent_handle] -= self.GIFTING_REWARD
-
-                        # Reduce the gifting budget and send gifts to agents
-                        # in the beam trajectory
-                        self.gifting_budget[agent_handle] -= self.GIFTING_REWARD
-                        agents_to_gift = self._agents_in_beam_trajectory(agent_handle)
-                        gifted_agents += agents_to_gift
-                        for agent_to_gift in agents_to_gift:
-                            rewards[agent_to_gift] += self.GIFTING_REWARD / len(
-                                agents_to_gift
-                            )
-
-                    # Replenish the budget by 1 resource after colleting 2 resources
-                    # (only if replenishable budget is chosen)
-                    if (
-                        self.gifting_mechanism
-                        == utils.GiftingMechanism.REPLENISHABLE_BUDGET
-                        and self.collected_resources[agent_handle] % 2 == 0
-                        and self.collected_resources[agent_handle] != 0
-                    ):
-                        self.gifting_budget[agent_handle] += 1
+                    self.gifting_budget[agent_handle] += 1
 
         # Store the tagged agents and free the ones that were
         # tagged more than the specified timesteps ago
@@ -467,8 +562,8 @@ class CPRGridEnv(MultiAgentEnv, gym.Env):
             dones["__all__"] = True
 
         # Compute observations for each agent and store rewards history
+        observations = self._get_observations()
         for agent_handle in range(self.n_agents):
-            observations[agent_handle] = self._get_observation(agent_handle)
             self.rewards_history[agent_handle].append(rewards[agent_handle])
 
         # Add social outcome metrics to info dict
@@ -480,317 +575,111 @@ class CPRGridEnv(MultiAgentEnv, gym.Env):
 
         return observations, rewards, dones, infos
 
-    def _compute_new_agent_position(self, agent_handle, action):
-        """
-        Compute a new position for the given agent, after performing
-        the given action
-        """
-        assert agent_handle in range(
-            self.n_agents
-        ), "The given agent handle does not exist"
-
-        # Compute new position
-        current_position = self.agent_positions[agent_handle]
-        new_position = current_position.get_new_position(action)
-
-        # If move is not feasible the agent stands still
-        if not self._is_move_feasible(action, new_position):
-            return current_position
-
-        return new_position
-
-    def _move_agent(self, agent_handle, new_position):
-        """
-        Set the previous position as empty and the new one as occupied
-        """
-        assert isinstance(
-            new_position, utils.AgentPosition
-        ), "The given position should be an instance of AgentPosition"
-        current_position = self.agent_positions[agent_handle]
-        self.grid[current_position.y, current_position.x] = utils.GridCell.EMPTY.value
-        self.grid = self._mark_orientation(self.grid, current_position, remove=True)
-        self.grid[new_position.y, new_position.x] = utils.GridCell.AGENT.value
-        self.grid = self._mark_orientation(self.grid, new_position)
-        self.agent_positions[agent_handle] = new_position
-
-    def _is_move_feasible(self, action, new_position):
-        """
-        Check if the move leading the agent to the given position
-        is a feasible move or an illegal one
-        """
-        return self._is_position_in_grid(new_position) and (
-            not self._is_position_occupied(new_position)
-            or utils.AgentAction.is_still_action(action)
-        )
-
-    def _is_position_occupied(self, position):
-        """
-        Check if the given position is occupied by another agent in the grid
-        """
-        assert isinstance(
-            position, utils.AgentPosition
-        ), "The given position should be an instance of AgentPosition"
-        return self.grid[position.y, position.x] == utils.GridCell.AGENT.value
-
-    def _is_position_in_grid(self, position):
-        """
-        Check if the given position is within the boundaries of the grid
-        """
-        assert isinstance(
-            position, utils.AgentPosition
-        ), "The given position should be an instance of AgentPosition"
-        if position.x < 0 or position.x >= self.grid_width:
-            return False
-        if position.y < 0 or position.y >= self.grid_height:
-            return False
-        return True
-
-    def _has_resource(self, position):
-        """
-        Check if the given position is occupied by a resource in the grid
-        """
-        assert isinstance(
-            position, utils.AgentPosition
-        ), "The given position should be an instance of utils.AgentPosition"
-        return self.grid[position.y, position.x] == utils.GridCell.RESOURCE.value
-
     def _is_resource_depleted(self):
         """
         Check if there is at least one resource available in the environment
         or if the resource is depleted
         """
-        return len(self.grid[self.grid == utils.GridCell.RESOURCE.value]) == 0
+        return self._n_resources == 0
 
-    def _agents_in_beam_trajectory(self, agent_handle):
+    def _get_observations(self):
         """
-        Perform the tagging action from the point of view of the given agent,
-        by marking agents in the beam trajectory for future timesteps
+        Extract a rectangular FOV based on each agent's position and convert
+        them into RGB images, stored in a single array of shape
+        (n_agents, *observation_shape), and return a dictionary of views on it
         """
-        # Create a grid with the same size as the original one,
-        # but only containing agent handles
-        agents_grid = np.full((self.grid_height, self.grid_width), -1)
-        for h, agent_position in enumerate(self.agent_positions):
-            if h != agent_handle:
-                agents_grid[agent_position.y, agent_position.x] = h
-
-        # Extract the beam FOV from the agent handles grid
-        # and find the tagged agents
-        fov = self._extract_fov(agent_handle, grid=agents_grid, beam=True, pad_value=-1)
-        tagged_agents = fov[fov != -1]
+        xs, ys, orientations = self._positions.T
 
-        return list(tagged_agents)
-
-    def _get_observation(self, agent_handle):
-        """
-        Extract a rectangular FOV based on the given agent's position
-        and convert it into an RGB image
-        """
-        # Extract the FOV and convert it to 3 channels
-        fov = self.grid.copy()
-        if not self.global_obs:
-            fov = self._extract_fov(agent_handle)
-        fov = np.stack((fov,) * 3, axis=-1)
-
-        # Set color for resources
-        fov = np.where(
-            fov == utils.GridCell.RESOURCE,
-            colors.to_rgb(self.GRID_CELL_COLORS[utils.GridCell.RESOURCE]),
-            fov,
-        )
-
-        # Set color for opponents
-        fov = np.where(
-            fov == utils.GridCell.AGENT,
-            colors.to_rgb(self.GRID_CELL_COLORS[utils.GridCell.AGENT]),
-            fov,
-        )
-
-        # Set color for padding cells
-        fov = np.where(
-            fov == utils.GridCell.OUTSIDE,
-            colors.to_rgb(self.GRID_CELL_COLORS[utils.GridCell.OUTSIDE]),
-            fov,
-        )
-
-        # Set color for current agent
-        x = (
-            self.fov_squares_side
-            if not self.global_obs
-            else self.agent_positions[agent_handle].x
-        )
-        y = 0 if not self.global_obs else self.agent_positions[agent_handle].y
-        fov[y, x] = colors.to_rgb(self.FOV_OWN_AGENT_COLOR)
+        # Extract the FOV of all agents at once
+        if self.global_obs:
+            fovs = np.broadcast_to(self.grid, (self.n_agents,) + self.grid.shape)
+            own_ys, own_xs = ys, xs
+        else:
+            self._update_padded_grid()
+            pad = self._fov_padding
+            fovs = self._padded_grid[
+                (ys + pad)[:, np.newaxis, np.newaxis] + self._fov_dys[orientations],
+                (xs + pad)[:, np.newaxis, np.newaxis] + self._fov_dxs[orientations],
+            ]
+            own_ys, own_xs = self._fov_agent_cells[orientations].T
 
-        # Rotate again so as to have a different observation
-        # depending on the agent's orientation (only for local observations)
-        if not self.global_obs:
-            agent_position = self.agent_positions[agent_handle]
-            k = (
-                1
-                if agent_position.o == utils.AgentOrientation.RIGHT
-                else 2
-                if agent_position.o == utils.AgentOrientation.UP
-                else 3
-                if agent_position.o == utils.AgentOrientation.LEFT
-                else 0
-            )
-            fov = np.rot90(fov, k=k).copy()
+        # Convert FOVs to RGB and set color for current agents
+        observations = self.OBSERVATION_PALETTE[fovs - utils.GridCell.OUTSIDE.value]
+        observations[np.arange(self.n_agents), own_ys, own_xs] = self.FOV_OWN_AGENT_RGB
 
-        return fov
+        return {h: observations[h] for h in range(self.n_agents)}
 
     def _respawn_resources(self):
         """
         Respawn resources based on the number of already-spawned resources
         in a ball centered around each currently empty location
         """
-        for x, y in itertools.product(range(self.grid_width), range(self.grid_height)):
-            if (
-                self.grid[y, x] == utils.GridCell.EMPTY.value
-                and self._initial_grid[y, x] == utils.GridCell.RESOURCE.value
-            ):
-                ball = self._extract_ball(x, y)
-                l = len(ball[ball == utils.GridCell.RESOURCE.value])
-                p = self._respawn_probability(l)
-                if np.random.binomial(1, p):
-                    self.grid[y, x] = utils.GridCell.RESOURCE.value
+        candidates = (self.grid == utils.GridCell.EMPTY.value) & (
+            self._initial_grid == utils.GridCell.RESOURCE.value
+        )
+        counts = _ball_counts_kernel(self.grid, candidates, self._ball_kernel)
+        respawn_mask = candidates & (
+            self._rng.random(self.grid.shape) < self._respawn_probability(counts)
+        )
+        self.grid[respawn_mask] = utils.GridCell.RESOURCE.value
+        self._n_resources += np.count_nonzero(respawn_mask)
 
     def _respawn_probability(self, l):
         """
         Compute the respawn probability of a resource in an unspecified
         location based on the number of nearby resources
+        (the given number of resources can also be an array of counts)
         """
-        if l == 1 or l == 2:
-            return 0.01
-        elif l == 3 or l == 4:
-            return 0.05
-        elif l > 4:
-            return 0.1
-        return 0
+        return np.select(
+            [(l == 1) | (l == 2), (l == 3) | (l == 4), l > 4], [0.01, 0.05, 0.1], 0
+        )
 
-    def _pad_grid(self, grid, x, y, xl, yl, pad_value=0):
+    def _get_fov_offsets(self):
         """
-        Pad the 2D grid by computing pad widths based
-        on the given position and span lenghts in both axes
+        Compute the (dy, dx) offsets of each FOV cell w.r.t. the agent's
+        position, for each orientation, and the FOV cell of the agent itself
         """
-        height, width = grid.shape
-        x_pad_width = (
-            abs(np.clip(x - xl, None, 0)),
-            np.clip(x + xl - width + 1, 0, None),
-        )
-        y_pad_width = (
-            abs(np.clip(y - yl, None, 0)),
-            np.clip(y + yl - height + 1, 0, None),
-        )
-        padded_grid = np.pad(
-            grid,
-            pad_width=[y_pad_width, x_pad_width],
-            mode="constant",
-            constant_values=pad_value,
-        )
-        return padded_grid, x_pad_width, y_pad_width
-
-    def _extract_fov(self, agent_handle, grid=None, beam=False, pad_value=None):
-        """
-        Extract a rectangular local observation from the 2D grid,
-        from the point of view of the given agent
-        """
-        # Get the current agent's position
-        agent_position = self.agent_positions[agent_handle]
-
-        # Rotate the grid based on agent's orientation so that
-        # we are always facing downwards
-        grid = grid if grid is not None else self.grid.copy()
-        k = (
-            1
-            if agent_position.o == utils.AgentOrientation.LEFT
-            else 2
-            if agent_position.o == utils.AgentOrientation.UP
-            else 3
-            if agent_position.o == utils.AgentOrientation.RIGHT
-            else 0
-        )
-        rotated_grid = np.rot90(grid, k=k)
+        front = np.arange(self.fov_squares_front)[:, np.newaxis]
+        side = np.arange(-self.fov_squares_side, self.fov_squares_side + 1)
+        dys, dxs, agent_cells = [], [], []
+        for o in utils.AgentOrientation:
+            # When the agent faces downwards, FOV rows move forward
+            # and FOV columns move towards the agent's left
+            fx = utils.ACTION_DX[o, utils.AgentAction.STEP_FORWARD]
+            fy = utils.ACTION_DY[o, utils.AgentAction.STEP_FORWARD]
+            lx = utils.ACTION_DX[o, utils.AgentAction.STEP_LEFT]
+            ly = utils.ACTION_DY[o, utils.AgentAction.STEP_LEFT]
 
-        # Compute agent's coordinates on the rotated grid
-        coords = list(
-            itertools.product(range(self.grid_height), range(self.grid_width))
-        )
-        coords = np.array(coords).reshape(self.grid_height, self.grid_width, 2)
-        rotated_coords = np.rot90(coords, k=k)
-        rotated_y, rotated_x = np.argwhere(
-            (rotated_coords[:, :, 0] == agent_position.y)
-            & (rotated_coords[:, :, 1] == agent_position.x)
-        )[0]
-
-        # Set front and side squares to extract based on whether we are
-        # computing the FOV for the observation or for tagging other agents
-        squares_front = self.fov_squares_front if not beam else self.beam_squares_front
-        squares_side = self.fov_squares_side if not beam else self.beam_squares_side
-
-        # Pad the 2D grid so as not have indexing errors in FOV extraction
-        padded_grid, x_pad_width, y_pad_width = self._pad_grid(
-            rotated_grid,
-            rotated_x,
-            rotated_y,
-            squares_side,
-            squares_front + k % 2,
-            pad_value=pad_value or utils.GridCell.OUTSIDE.value,
-        )
-
-        # Extract the FOV
-        sx, ex = (
-            x_pad_width[0] + rotated_x - squares_side,
-            x_pad_width[0] + rotated_x + squares_side + 1,
-        )
-        sy, ey = (
-            y_pad_width[0] + rotated_y,
-            y_pad_width[0] + rotated_y + squares_front,
-        )
-        fov = padded_grid[sy:ey, sx:ex]
-        assert fov.shape == (
-            squares_front,
-            squares_side * 2 + 1,
-        ), "There was an error in FOV extraction, incorrect shape"
+            # Rotate offsets so as to have a different observation
+            # depending on the agent's orientation
+            k = (
+                1
+                if o == utils.AgentOrientation.RIGHT
+                else 2
+                if o == utils.AgentOrientation.UP
+                else 3
+                if o == utils.AgentOrientation.LEFT
+                else 0
+            )
+            dy = np.rot90(front * fy + side * ly, k=k)
+            dx = np.rot90(front * fx + side * lx, k=k)
+            dys.append(dy)
+            dxs.append(dx)
+            agent_cells.append(tuple(np.argwhere((dy == 0) & (dx == 0))[0]))
 
-        return fov
+        return np.stack(dys), np.stack(dxs), np.array(agent_cells)
 
-    def _extract_ball(self, x, y):
+    def _update_padded_grid(self):
         """
-        Extract a ball-shaped local patch from the 2D grid,
-        centered around the given position
+        Copy the current grid to the inner part of the padded grid,
+        so that it can be used to extract local observations
         """
-        # Pad the 2D grid so as not have indexing errors in ball extraction
-        padded_grid, x_pad_width, y_pad_width = self._pad_grid(
-            self.grid,
-            x,
-            y,
-            self.ball_radius,
-            self.ball_radius,
-            pad_value=utils.GridCell.EMPTY.value,
-        )
-
-        # Extract the ball
-        sx, ex = (
-            x_pad_width[0] + x - self.ball_radius,
-            x_pad_width[0] + x + self.ball_radius + 1,
-        )
-        sy, ey = (
-            y_pad_width[0] + y - self.ball_radius,
-            y_pad_width[0] + y + self.ball_radius + 1,
-        )
-        ball = padded_grid[sy:ey, sx:ex]
-
-        # Compute a boolean mask shaped like a ball
-        # (see https://stackoverflow.com/questions/8647024/how-to-apply-a-disc-shaped-mask-to-a-numpy-array)
-        kernel = np.zeros((2 * self.ball_radius + 1, 2 * self.ball_radius + 1))
-        yg, xg = np.ogrid[
-            -self.ball_radius : self.ball_radius + 1,
-            -self.ball_radius : self.ball_radius + 1,
-        ]
-        mask = xg ** 2 + yg ** 2 <= self.ball_radius ** 2
-        kernel[mask] = 1
-
-        return ball[kernel.astype(bool)]
+        if self.global_obs:
+            return
+        pad = self._fov_padding
+        self._padded_grid[
+            pad : pad + self.grid_height, pad : pad + self.grid_width
+        ] = self.grid
 
     def _get_returns(self):
         """
@@ -99,6 +99,30 @@ class AgentAction(CustomIntEnum):
         return action in cls.still_actions()
 
 
+# Displacement along the x axis, displacement along the y axis and
+# change of orientation caused by each action, indexed by [orientation, action]
+# (orientations and actions are sorted as in AgentOrientation and AgentAction)
+ACTION_DX = np.array(
+    [
+        [0, 0, -1, 1, 0, 0, 0, 0, 0],
+        [1, -1, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 1, -1, 0, 0, 0, 0, 0],
+        [-1, 1, 0, 0, 0, 0, 0, 0, 0],
+    ],
+    dtype=np.int32,
+)
+ACTION_DY = np.array(
+    [
+        [-1, 1, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, -1, 1, 0, 0, 0, 0, 0],
+        [1, -1, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 1, -1, 0, 0, 0, 0, 0],
+    ],
+    dtype=np.int32,
+)
+ACTION_DO = np.array([[0, 0, 0, 0, -1, 1, 0, 0, 0]] * 4, dtype=np.int32)
+
+
 class CPRGridActionSpace(spaces.Discrete):
     """
     The action space spanned by all the possible agent actions
@@ -256,9 +280,18 @@ class AgentPosition:
         assert AgentAction.is_valid(
             action
         ), f"The given action should be compatible with AgentAction, {action} {AgentAction.values()}, {type(action)}"
-        if isinstance(action, int) or isinstance(action, np.int64):
-            action = AgentAction(action)
-        return getattr(self, action.name.lower())()
+        dx, dy, do = (
+            ACTION_DX[self.o, action],
+            ACTION_DY[self.o, action],
+            ACTION_DO[self.o, action],
+        )
+        if dx == 0 and dy == 0 and do == 0:
+            return self
+        return AgentPosition(
+            self.x + int(dx),
+            self.y + int(dy),
+            AgentOrientation((self.o + do) % AgentOrientation.size()),
+        )
 
     def __repr__(self):
         return f"AgentPosition({self.x}, {self.y}, {self.o.name})"
@@ -0,0 +1,167 @@
+import numpy as np
+from numba import njit, prange
+
+from . import utils
+from .cpr_grid import CPRGridEnv, _step_kernel
+
+
+@njit(parallel=True, cache=True)
+def _vec_step_kernel(
+    grids, positions, actions, tagging_ability, beam_squares_front, beam_squares_side
+):
+    """
+    Move all agents in a batch of environments, by running the
+    single-environment step kernel on each environment in parallel
+    """
+    n_envs, n_agents = positions.shape[0], positions.shape[1]
+    acted = np.zeros((n_envs, n_agents), dtype=np.bool_)
+    collected = np.zeros((n_envs, n_agents), dtype=np.bool_)
+    beams = np.zeros((n_envs, n_agents, n_agents), dtype=np.bool_)
+    for i in prange(n_envs):
+        env_acted, env_collected, env_beams = _step_kernel(
+            grids[i],
+            positions[i],
+            actions[i],
+            tagging_ability,
+            beam_squares_front,
+            beam_squares_side,
+        )
+        acted[i] = env_acted
+        collected[i] = env_collected
+        beams[i] = env_beams
+    return acted, collected, beams
+
+
+class VecCPRGridEnv:
+    """
+    Batch of independent CPR appropriation environments with the same parameters,
+    whose grids and agent positions are stored in contiguous arrays, so that
+    agents in all environments can be moved in a single parallel pass
+    """
+
+    def __init__(self, n_envs, **env_kwargs):
+        assert n_envs > 0, "The number of environments should be positive"
+        self.n_envs = n_envs
+        self.envs = [CPRGridEnv(**env_kwargs) for _ in range(self.n_envs)]
+        self.n_agents = self.envs[0].n_agents
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+
+        # Shared buffers, with shape (n_envs, height, width)
+        # and (n_envs, n_agents, 3) respectively
+        self.grids, self.positions = None, None
+
+    def seed(self, seed=None):
+        """
+        Seed all the environments with independent random streams,
+        derived from the given seed
+        """
+        seeds = np.random.SeedSequence(seed).spawn(self.n_envs)
+        for env, env_seed in zip(self.envs, seeds):
+            env.seed(env_seed)
+        return [seed]
+
+    def reset(self):
+        """
+        Reset all the environments and return observations
+        as an array of shape (n_envs, n_agents, *observation_shape)
+        """
+        observations = [env.reset() for env in self.envs]
+        self.grids = np.stack([env.grid for env in self.envs])
+        self.positions = np.stack([env._positions for env in self.envs])
+        for i in range(self.n_envs):
+            self._share_buffers(i)
+        return np.stack([self._stack_observations(obs) for obs in observations])
+
+    def _share_buffers(self, i):
+        """
+        Copy the state of the i-th environment to the shared buffers
+        and let the environment work on views of such buffers
+        """
+        env = self.envs[i]
+        self.grids[i] = env.grid
+        self.positions[i] = env._positions
+        env.grid, env._positions = self.grids[i], self.positions[i]
+
+    def _stack_observations(self, observations):
+        """
+        Convert the given dictionary of observations (one for each agent)
+        to an array of shape (n_agents, *observation_shape)
+        """
+        return np.stack(
+            [observations[agent_handle] for agent_handle in range(self.n_agents)]
+        )
+
+    def get_legal_actions(self):
+        """
+        Return a mask of shape (n_envs, n_agents, n_actions) to be used
+        to remove illegal actions when computing policy probabilities
+        """
+        return np.array(
+            [
+                [env.get_legal_actions(h) for h in range(self.n_agents)]
+                for env in self.envs
+            ],
+            dtype=bool,
+        )
+
+    def step(self, actions):
+        """
+        Perform a step in all the environments, given actions as an array of
+        shape (n_envs, n_agents), and return observations, rewards and dones
+        as arrays (with leading dimensions n_envs and n_agents, for the first two)
+        and infos as a list of dictionaries
+
+        Environments that are done are automatically reset, and their last
+        observations are stored in the info dictionary, with key "terminal_observations"
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        assert actions.shape == (
+            self.n_envs,
+            self.n_agents,
+        ), "Actions should be given as an array of shape (n_envs, n_agents)"
+        assert (
+            (actions >= 0) & (actions < utils.AgentAction.size())
+        ).all(), "The given actions should be compatible with AgentAction"
+
+        # Move all agents in all environments
+        env = self.envs[0]
+        acted, collected, beams = _vec_step_kernel(
+            self.grids,
+            self.positions,
+            actions,
+            env.tagging_ability,
+            env.beam_squares_front,
+            env.beam_squares_side,
+        )
+
+        # Complete the step in each environment and reset
+        # the ones that reached the end of the episode
+        observations, infos = [], []
+        rewards = np.zeros((self.n_envs, self.n_agents), dtype=np.float32)
+        dones = np.zeros(self.n_envs, dtype=bool)
+        for i, env in enumerate(self.envs):
+            (
+                env_observations,
+                env_rewards,
+                env_dones,
+                env_infos,
+            ) = env._complete_step(actions[i], acted[i], collected[i], beams[i])
+            env_observations = self._stack_observations(env_observations)
+            rewards[i] = [env_rewards[h] for h in range(self.n_agents)]
+            dones[i] = env_dones["__all__"]
+            if dones[i]:
+                env_infos["terminal_observations"] = env_observations
+                env_observations = self._stack_observations(env.reset())
+                self._share_buffers(i)
+            observations.append(env_observations)
+            infos.append(env_infos)
+
+        return np.stack(observations), rewards, dones, infos
+
+    def close(self):
+        """
+        Close all the environments
+        """
+        for env in self.envs:
+            env.close()
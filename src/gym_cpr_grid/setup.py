@@ -8,6 +8,6 @@ setup(
     author="Alessio Falai",
     author_email="falai.alessio@gmail.com",
     license="MIT",
-    install_requires=["gym"],
+    install_requires=["gym", "numba"],
     packages=["gym_cpr_grid"],
 )
@@ -1,105 +1,177 @@
+from functools import lru_cache
+
 import numpy as np
 import torch
+from scipy.signal import lfilter
+from numba import njit, prange
 
 from . import utils
 
 
+@njit(parallel=True, cache=True)
+def _returns_to_go_kernel(rewards, offsets, discount, out):
+    """
+    Compute returns-to-go of a set of trajectories, whose rewards are
+    concatenated in the given array and delimited by the given offsets,
+    and write them in the output array, which can also be the rewards array
+    (each trajectory is processed in parallel and rewards are discounted
+    w.r.t. its first time-step, as in Trajectory.get_returns)
+    """
+    for i in prange(len(offsets) - 1):
+        start, end = offsets[i], offsets[i + 1]
+        returns = 0.0
+        for t in range(end - 1, start - 1, -1):
+            returns = rewards[t] + discount * returns
+            out[t] = returns * discount ** (t - start)
+
+
+@lru_cache(maxsize=32)
+def _get_discount_vector(discount, timesteps):
+    """
+    Return a read-only vector containing the discount factor
+    raised to the power of each time-step in [0, timesteps)
+    """
+    discount_per_timestep = discount ** np.arange(timesteps)
+    discount_per_timestep.flags.writeable = False
+    return discount_per_timestep
+
+
 class Trajectory:
     """
     A trajectory is a list of (s, a, r, s') tuples, that represents an
     agent's transition from state s to state s', by taking action a and
     observing reward r
+
+    Each element of the tuples is stored in its own C-contiguous Numpy buffer,
+    with time as the leading dimension (e.g. states have shape (T, *obs_shape)),
+    which is allocated when the first time-step is added (so as to infer shapes
+    and types) and whose capacity is doubled whenever it becomes full
     """
 
-    def __init__(self):
-        self.states = []
-        self.actions = []
-        self.action_probs = []
-        self.legal_actions = []
-        self.rewards = []
-        self.next_states = []
+    def __init__(self, capacity=256):
+        assert capacity > 0, "The initial capacity should be positive"
+        self.capacity = capacity
+        self.states = None
+        self.actions = None
+        self.action_probs = None
+        self.legal_actions = None
+        self.rewards = None
+        self.next_states = None
         self.current_timestep = 0
         self.device = utils.get_torch_device()
 
+    def _allocate_buffers(self, state, action, action_probs, reward, next_state):
+        """
+        Allocate one buffer for each element of the (s, a, r, s') tuple,
+        with shapes and types inferred from the given time-step
+        (actions are always stored as 64-bit integers, independently of
+        the platform's default, and legal actions have the same shape
+        as action probabilities)
+        """
+
+        def _empty_like(value, dtype=None):
+            value = np.asarray(value, dtype=dtype)
+            return np.empty((self.capacity,) + value.shape, dtype=value.dtype)
+
+        self.states = _empty_like(state)
+        self.actions = _empty_like(action, dtype=np.int64)
+        self.action_probs = _empty_like(action_probs)
+        self.rewards = _empty_like(reward, dtype=np.float64)
+        self.next_states = _empty_like(next_state)
+        self.legal_actions = np.empty(self.action_probs.shape, dtype=bool)
+
+    def _grow_buffers(self):
+        """
+        Double the capacity of all buffers, by preserving their content
+        """
+
+        def _grow(buffer):
+            new_buffer = np.empty(
+                (2 * self.capacity,) + buffer.shape[1:], dtype=buffer.dtype
+            )
+            new_buffer[: self.capacity] = buffer
+            return new_buffer
+
+        self.states = _grow(self.states)
+        self.actions = _grow(self.actions)
+        self.action_probs = _grow(self.action_probs)
+        self.rewards = _grow(self.rewards)
+        self.next_states = _grow(self.next_states)
+        self.legal_actions = _grow(self.legal_actions)
+        self.capacity *= 2
+
     def add_timestep(
         self, state, action, action_probs, reward, next_state, legal_actions=None
     ):
         """
         Add the given (s, a, r, s') tuple to the trajectory
         """
-        self.states.append(state)
-        self.actions.append(action)
-        self.action_probs.append(action_probs)
-        self.rewards.append(reward)
-        self.next_states.append(next_state)
-        self.legal_actions.append(legal_actions or [True] * len(action_probs))
+        if self.states is None:
+            self._allocate_buffers(state, action, action_probs, reward, next_state)
+        elif self.current_timestep == self.capacity:
+            self._grow_buffers()
+        assert (
+            np.shape(state) == self.states.shape[1:]
+            and np.shape(next_state) == self.states.shape[1:]
+        ), "States should have the same shape across all time-steps"
+        t = self.current_timestep
+        self.states[t] = state
+        self.actions[t] = action
+        self.action_probs[t] = action_probs
+        self.rewards[t] = reward
+        self.next_states[t] = next_state
+        self.legal_actions[t] = legal_actions if legal_actions is not None else True
         self.current_timestep += 1
 
+    def _get_buffer(self, buffer, as_torch=True):
+        """
+        Return the filled part of the given buffer
+        either as a Numpy array or as a PyTorch tensor
+        """
+        values = buffer[: self.current_timestep] if buffer is not None else np.empty(0)
+        return values if not as_torch else torch.from_numpy(values).to(self.device)
+
     def get_states(self, as_torch=True):
         """
         Return the list of states in the current trajectory
         either as a Numpy array or as a PyTorch tensor
         """
-        return (
-            np.array(self.states)
-            if not as_torch
-            else torch.tensor(self.states, device=self.device)
-        )
+        return self._get_buffer(self.states, as_torch=as_torch)
 
     def get_actions(self, as_torch=True):
         """
         Return the list of actions in the current trajectory
         either as a Numpy array or as a PyTorch tensor
         """
-        return (
-            np.array(self.actions)
-            if not as_torch
-            else torch.tensor(self.actions, device=self.device)
-        )
+        return self._get_buffer(self.actions, as_torch=as_torch)
 
     def get_action_probs(self, as_torch=True):
         """
         Return the list of action probabilities in the current trajectory
         either as a Numpy array or as a PyTorch tensor
         """
-        return (
-            np.array(self.action_probs)
-            if not as_torch
-            else torch.tensor(self.action_probs, device=self.device)
-        )
+        return self._get_buffer(self.action_probs, as_torch=as_torch)
 
     def get_rewards(self, as_torch=True):
         """
         Return the list of rewards in the current trajectory
         either as a Numpy array or as a PyTorch tensor
         """
-        return (
-            np.array(self.rewards)
-            if not as_torch
-            else torch.tensor(self.rewards, device=self.device)
-        )
+        return self._get_buffer(self.rewards, as_torch=as_torch)
 
     def get_next_states(self, as_torch=True):
         """
         Return the list of next states in the current trajectory
         either as a Numpy array or as a PyTorch tensor
         """
-        return (
-            np.array(self.next_states)
-            if not as_torch
-            else torch.tensor(self.next_states, device=self.device)
-        )
+        return self._get_buffer(self.next_states, as_torch=as_torch)
 
     def get_legal_actions(self, as_torch=True):
         """
         Return the list of legal actions in the current trajectory
         either as a Numpy array or as a PyTorch tensor
         """
-        return (
-            np.array(self.legal_actions)
-            if not as_torch
-            else torch.tensor(self.legal_actions, device=self.device)
-        )
+        return self._get_buffer(self.legal_actions, as_torch=as_torch)
 
     def get_returns(self, max_timestep=None, discount=1, to_go=False, as_torch=True):
         """
@@ -111,28 +183,44 @@ class Trajectory:
         if max_timestep is None:
             max_timestep = self.current_timestep
         max_timestep = np.clip(max_timestep, 0, self.current_timestep)
-        discount_per_timestep = discount ** np.arange(max_timestep)
-        returns_per_timestep = np.cumsum(
-            np.array(self.rewards)[::-1] * discount_per_timestep[::-1]
-        )[::-1]
-        returns = returns_per_timestep[0] if not to_go else returns_per_timestep
-        return (
-            returns
-            if not as_torch
-            else torch.tensor(returns.copy(), dtype=torch.float32, device=self.device)
-        )
+        rewards = self.get_rewards(as_torch=False)[:max_timestep]
+        if not to_go:
+            # The full return is a single reduction over rewards,
+            # so avoid computing returns for every time-step
+            returns = (
+                rewards.sum()
+                if discount == 1
+                else np.dot(rewards, _get_discount_vector(discount, int(max_timestep)))
+            )
+        elif discount == 1:
+            # Undiscounted rewards-to-go are a reversed cumulative sum
+            returns = np.cumsum(rewards[::-1])[::-1]
+        else:
+            # Discounted rewards-to-go are computed with a first-order IIR filter
+            # on reversed rewards, and then discounted w.r.t. the first time-step
+            discount_per_timestep = _get_discount_vector(discount, int(max_timestep))
+            returns = (
+                lfilter([1.0], [1.0, -discount], rewards[::-1])[::-1]
+                * discount_per_timestep
+            )
+        if not as_torch:
+            return returns
+
+        # Cast to a contiguous float32 array with a single copy,
+        # and share its memory with the returned tensor
+        return torch.from_numpy(np.array(returns, dtype=np.float32)).to(self.device)
 
     def __getitem__(self, t):
         """
         Return the (s, a, r, s') tuple at time-step t
         """
         return (
-            self.states[t],
-            self.actions[t],
-            self.action_probs[t],
-            self.rewards[t],
-            self.next_states[t],
-            self.legal_actions[t]
+            self.get_states(as_torch=False)[t],
+            self.get_actions(as_torch=False)[t],
+            self.get_action_probs(as_torch=False)[t],
+            self.get_rewards(as_torch=False)[t],
+            self.get_next_states(as_torch=False)[t],
+            self.get_legal_actions(as_torch=False)[t],
         )
 
     def __len__(self):
@@ -153,13 +241,53 @@ class TrajectoryPool:
     A trajectory pool is a set of trajectories
     """
 
-    def __init__(self, discount=1, minibatch_size=None, n=0):
+    def __init__(
+        self,
+        discount=1,
+        minibatch_size=None,
+        n=0,
+        states_dtype=torch.float32,
+        actions_dtype=torch.int64,
+        legal_actions_dtype=torch.bool,
+        drop_last=True,
+    ):
         self.trajectories = [Trajectory() for _ in range(n)]
         self.discount = discount
         self.device = utils.get_torch_device()
         self.minibatch_size = minibatch_size
+        self.drop_last = drop_last
         self._current_minibatch = None
+        self._num_minibatches = None
+        self._next_minibatch = None
         self._full_batch = None
+        self._permutation = None
+        self._dirty = True
+
+        # Stream used to gather the next mini-batch while the current one
+        # is being processed, if the pool lives on a GPU
+        self._prefetch_stream = (
+            torch.cuda.Stream(device=self.device)
+            if self.device.type == "cuda"
+            else None
+        )
+
+        # Types of states, actions, action probabilities, returns, next states
+        # and legal actions, once converted to tensors (they should have
+        # an equivalent Numpy type, e.g. float16 instead of bfloat16)
+        self.dtypes = (
+            states_dtype,
+            actions_dtype,
+            torch.float32,
+            torch.float32,
+            states_dtype,
+            legal_actions_dtype,
+        )
+
+        # Buffers re-used every time the pool is converted to tensors
+        self._capacity = 0
+        self._host_buffers = None
+        self._device_buffers = None
+        self._copy_event = None
 
     def add(self, trajectory):
         """
@@ -169,6 +297,7 @@ class TrajectoryPool:
             trajectory, Trajectory
         ), "The given trajectory should be an instance of the Trajectory class"
         self.trajectories.append(trajectory)
+        self._dirty = True
 
     def extend(self, trajectory_pool):
         """
@@ -177,8 +306,8 @@ class TrajectoryPool:
         assert isinstance(
             trajectory_pool, TrajectoryPool
         ), "The given trajectory pool should be an instance of the TrajectoryPool class"
-        for i in range(trajectory_pool.num_trajectories()):
-            self.add(trajectory_pool.get_trajectory(i))
+        self.trajectories.extend(trajectory_pool.trajectories)
+        self._dirty = True
 
     def add_to_trajectory(
         self, i, state, action, action_probs, reward, next_state, legal_actions=None
@@ -189,40 +318,90 @@ class TrajectoryPool:
         self.trajectories[i].add_timestep(
             state, action, action_probs, reward, next_state, legal_actions=legal_actions
         )
+        self._dirty = True
 
-    def tensorify(self):
+    def clear(self):
         """
-        Convert the current pool of trajectories to
-        a set of PyTorch tensors
+        Remove all trajectories from the pool, while keeping
+        buffers to be re-used when converting it to tensors
         """
-        states, actions, action_probs, legal_actions, returns, next_states = (
-            [],
-            [],
-            [],
-            [],
-            [],
-            [],
+        self.trajectories = []
+        self._dirty = True
+
+    def _allocate_buffers(self, shapes, timesteps):
+        """
+        Allocate one host buffer (in page-locked memory, if the target
+        device is a GPU) and one device buffer for each field, with the given
+        shapes and room for at least the given number of time-steps
+        """
+        pin_memory = self.device.type == "cuda"
+        self._capacity = max(timesteps, 2 * self._capacity)
+        self._host_buffers = tuple(
+            torch.empty((self._capacity,) + shape, dtype=dtype, pin_memory=pin_memory)
+            for shape, dtype in zip(shapes, self.dtypes)
         )
-        for trajectory in self.trajectories:
-            states.append(trajectory.get_states(as_torch=True))
-            actions.append(trajectory.get_actions(as_torch=True))
-            action_probs.append(trajectory.get_action_probs(as_torch=True))
-            returns.append(
-                trajectory.get_returns(
-                    discount=self.discount, to_go=True, as_torch=True
-                )
+        self._device_buffers = (
+            tuple(torch.empty_like(b, device=self.device) for b in self._host_buffers)
+            if pin_memory
+            else self._host_buffers
+        )
+        self._copy_event = None
+
+    def tensorify(self):
+        """
+        Convert the current pool of trajectories to a set of PyTorch
+        tensors (which are views on buffers re-used by the following calls)
+        """
+        # Collect states, actions, action probabilities, rewards,
+        # next states and legal actions of each trajectory
+        fields = [
+            (
+                trajectory.get_states(as_torch=False),
+                trajectory.get_actions(as_torch=False),
+                trajectory.get_action_probs(as_torch=False),
+                trajectory.get_rewards(as_torch=False),
+                trajectory.get_next_states(as_torch=False),
+                trajectory.get_legal_actions(as_torch=False),
             )
-            next_states.append(trajectory.get_next_states(as_torch=True))
-            legal_actions.append(trajectory.get_legal_actions(as_torch=True))
+            for trajectory in self.trajectories
+            if len(trajectory) > 0
+        ]
 
-        return (
-            torch.cat(states, dim=0).to(dtype=torch.float32, device=self.device),
-            torch.cat(actions, dim=0).to(dtype=torch.int64, device=self.device),
-            torch.cat(action_probs, dim=0).to(dtype=torch.float32, device=self.device),
-            torch.cat(returns, dim=0).to(dtype=torch.float32, device=self.device),
-            torch.cat(next_states, dim=0).to(dtype=torch.float32, device=self.device),
-            torch.cat(legal_actions, dim=0).to(dtype=torch.int64, device=self.device),
-        )
+        # Re-allocate buffers only if the current ones cannot hold the pool,
+        # otherwise wait for their previous transfer to complete
+        timesteps = len(self)
+        shapes = tuple(values.shape[1:] for values in fields[0])
+        if (
+            self._capacity < timesteps
+            or self._host_buffers is None
+            or shapes != tuple(b.shape[1:] for b in self._host_buffers)
+            or self.dtypes != tuple(b.dtype for b in self._host_buffers)
+        ):
+            self._allocate_buffers(shapes, timesteps)
+        elif self._copy_event is not None:
+            self._copy_event.synchronize()
+
+        # Concatenate each field of all trajectories directly into
+        # its host buffer, which already has the final type
+        host_tensors = tuple(b[:timesteps] for b in self._host_buffers)
+        for values, tensor in zip(zip(*fields), host_tensors):
+            np.concatenate(values, out=tensor.numpy())
+
+        # Replace rewards with the returns-to-go of all trajectories at once
+        returns = host_tensors[3].numpy()
+        offsets = np.cumsum([0] + [len(values[0]) for values in fields])
+        _returns_to_go_kernel(returns, offsets, float(self.discount), returns)
+
+        # Transfer each field to its device buffer with a single
+        # asynchronous copy
+        if self._device_buffers is self._host_buffers:
+            return host_tensors
+        device_tensors = tuple(b[:timesteps] for b in self._device_buffers)
+        for device_tensor, host_tensor in zip(device_tensors, host_tensors):
+            device_tensor.copy_(host_tensor, non_blocking=True)
+        self._copy_event = torch.cuda.Event()
+        self._copy_event.record()
+        return device_tensors
 
     def num_trajectories(self):
         """
@@ -252,31 +431,80 @@ class TrajectoryPool:
             for t in range(self.num_trajectories())
         ]
 
+    def num_minibatches(self, timesteps=None):
+        """
+        Return the number of mini-batches in an iteration over the pool,
+        or over the given number of time-steps
+        (the last incomplete mini-batch is discarded if `drop_last` is set)
+        """
+        if timesteps is None:
+            timesteps = len(self)
+        if self.drop_last:
+            return timesteps // self.minibatch_size
+        return -(-timesteps // self.minibatch_size)
+
     def __iter__(self):
         """
-        Initialize the iterator object
+        Initialize the iterator object (the full batch is re-computed
+        only if trajectories changed since the previous iteration, either
+        through the pool or by adding time-steps to them directly)
         """
         assert (
             self.minibatch_size is not None
         ), "To get an iterator, you have to set the mini-batch size parameter"
+        if self._prefetch_stream is not None:
+            torch.cuda.current_stream().wait_stream(self._prefetch_stream)
         self._current_minibatch = 0
-        self._full_batch = self.tensorify()
-        indices = torch.randperm(len(self))
-        self._full_batch = tuple(x[indices] for x in self._full_batch)
+        if (
+            self._dirty
+            or self._permutation is None
+            or len(self._permutation) != len(self)
+        ):
+            self._full_batch = self.tensorify()
+            self._permutation = torch.empty(
+                len(self._full_batch[0]), dtype=torch.int64, device=self.device
+            )
+            self._dirty = False
+        self._num_minibatches = self.num_minibatches(len(self._permutation))
+        torch.randperm(len(self._permutation), out=self._permutation)
+        self._next_minibatch = self._prefetch_minibatch(0)
         return self
 
+    def _prefetch_minibatch(self, k):
+        """
+        Start gathering the k-th mini-batch, on a separate
+        stream if the pool lives on a GPU
+        """
+        if k >= self._num_minibatches:
+            return None
+        start = k * self.minibatch_size
+        end = start + self.minibatch_size
+        indices = self._permutation[start:end]
+        if self._prefetch_stream is None:
+            return tuple(x[indices] for x in self._full_batch)
+        self._prefetch_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(self._prefetch_stream):
+            return tuple(x[indices] for x in self._full_batch)
+
     def __next__(self):
         """
         Return the next mini-batch
         """
-        timesteps = len(self)
-        if self._current_minibatch >= timesteps // self.minibatch_size:
+        if self._current_minibatch >= self._num_minibatches:
             raise StopIteration
 
-        start = self._current_minibatch * self.minibatch_size
-        end = start + self.minibatch_size
+        # Wait for the prefetched mini-batch to be ready
+        minibatch = self._next_minibatch
+        if self._prefetch_stream is not None:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_stream(self._prefetch_stream)
+            for x in minibatch:
+                x.record_stream(current_stream)
+
+        # Start gathering the following one
         self._current_minibatch += 1
-        return tuple(x[start:end] for x in self._full_batch)
+        self._next_minibatch = self._prefetch_minibatch(self._current_minibatch)
+        return minibatch
 
     def __len__(self):
         """
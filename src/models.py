@@ -2,6 +2,7 @@ from functools import partial
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
 from loguru import logger
 
@@ -54,11 +55,16 @@ class MLP(nn.Module):
         self.mlp = nn.Sequential(*linear_layers)
         self.log_softmax = log_softmax
 
+        # Pairs of linear layers and non-linearities, to be
+        # applied one after the other in the forward pass
+        self._layers = list(zip(self.mlp[::2], self.mlp[1::2]))
+
         # Print model summary
         logger.debug(f"Model summary: {self}")
 
-        # Orthogonal initialization
-        self.apply(init_weights)
+        # Orthogonal initialization of linear layers
+        for linear, _ in self._layers:
+            init_weights(linear)
 
         # Transfer to device
         self.to(utils.get_torch_device())
@@ -66,33 +72,37 @@ class MLP(nn.Module):
     def forward(self, x, mask=None):
         """
         Perform a single example or batch forward pass
+        (inputs are converted to the type of the network's parameters)
         """
-        start_dim = 0 if not self.training else 1
-        x = self.mlp(torch.flatten(x, start_dim=start_dim))
+        x = x.reshape(x.shape[0], -1) if self.training else x.reshape(-1)
+        x = x.to(dtype=self._layers[0][0].weight.dtype)
+        for linear, non_linearity in self._layers:
+            x = non_linearity(F.linear(x, linear.weight, linear.bias))
         if not self.log_softmax:
             return x
         return utils.masked_log_softmax(x, mask=mask, dim=-1)
 
-    def get_gradient_norm(self, norm_type=2.0):
+    def get_gradient_norm(self, norm_type=2.0, sync=False):
         """
         Compute the norm of the gradient w.r.t. the network parameters,
-        after calling loss.backward
+        after calling loss.backward (the norm is returned as a 0-d tensor
+        on the network's device, unless `sync` is set, in which case it is
+        copied to the host as a Python float)
 
         https://pytorch.org/docs/stable/_modules/torch/nn/utils/clip_grad.html#clip_grad_norm_
         """
-        norm = 0.0
-        parameters = [
-            p for p in self.parameters() if p.grad is not None and p.requires_grad
+        grads = [
+            p.grad.detach()
+            for p in self.parameters()
+            if p.grad is not None and p.requires_grad
         ]
-        if len(parameters) > 0:
-            device = parameters[0].grad.device
-            norm = torch.norm(
-                torch.stack(
-                    [
-                        torch.norm(p.grad.detach(), norm_type).to(device)
-                        for p in parameters
-                    ]
-                ),
-                norm_type,
-            ).item()
-        return norm
+        if len(grads) == 0:
+            return 0.0 if sync else torch.tensor(0.0, device=utils.get_torch_device())
+
+        # Compute per-parameter norms with a single fused call, if available
+        if hasattr(torch, "_foreach_norm"):
+            norms = torch._foreach_norm(grads, norm_type)
+        else:
+            norms = [torch.norm(g, norm_type) for g in grads]
+        total_norm = torch.norm(torch.stack(norms), norm_type)
+        return total_norm.item() if sync else total_norm
@@ -34,6 +34,12 @@ class VPGPolicy:
             alpha, float
         ), "The alpha hyperparameter should be given as float"
 
+        # Fix random seed (before the env is reset for the first time,
+        # and also for envs that have their own random number generator)
+        utils.set_seed(seed)
+        if hasattr(env, "seed"):
+            env.seed(seed)
+
         # Make the env a mult-agent one to have a single standard
         if not utils.is_multi_agent_env(env):
             env = utils.make_multi_agent(env)
@@ -44,9 +50,6 @@ class VPGPolicy:
         self.baseline_nn = baseline_nn
         self.alpha = alpha
 
-        # Fix random seed
-        utils.set_seed(seed)
-
         # Store useful env variables
         self.n_agents = self.env.n_agents if hasattr(self.env, "n_agents") else 1
         self.max_steps = self.env._max_episode_steps
@@ -120,6 +123,11 @@ class VPGPolicy:
             }
             wandb_run = utils.init_wandb(config=wandb_config)
 
+        # Initialize the pool of trajectories, to be re-used at each epoch
+        trajectories = memory.TrajectoryPool(
+            discount=discount, minibatch_size=minibatch_size
+        )
+
         # Iterate for the specified number of epochs
         current_episode = 0
         for epoch in range(epochs):
@@ -138,6 +146,7 @@ class VPGPolicy:
                 discount=discount,
                 episodes_mean_return=episodes_mean_return,
                 render_every=render_every,
+                trajectories=trajectories,
             )
 
             # Check if the trajectories collected are more than
@@ -155,7 +164,7 @@ class VPGPolicy:
 
             # Perform mini-batch updates
             epoch_loss = 0.0
-            num_minibatches = actual_batch_size // minibatch_size
+            num_minibatches = trajectories.num_minibatches()
             for minibatch, (
                 states,
                 actions,
@@ -217,13 +226,18 @@ class VPGPolicy:
         discount=0.99,
         episodes_mean_return=100,
         render_every=None,
+        trajectories=None,
     ):
         """
         Collect a buffer of timesteps of size at least `steps_per_epoch`
+        (if a trajectory pool is given, it is cleared and re-used)
         """
-        trajectories = memory.TrajectoryPool(
-            discount=discount, minibatch_size=minibatch_size
-        )
+        if trajectories is None:
+            trajectories = memory.TrajectoryPool(
+                discount=discount, minibatch_size=minibatch_size
+            )
+        else:
+            trajectories.clear()
         epoch_infos = defaultdict(list)
         epoch_returns = []
         while len(trajectories) < steps_per_epoch:
@@ -278,10 +292,10 @@ class VPGPolicy:
         if self.baseline_nn is not None:
             values = self.baseline_nn(states).squeeze()
 
-        # Compute loss
+        # Compute loss (actions are used as targets, so they should be int64)
         losses = self.compute_loss(
             returns,
-            actions,
+            actions.long(),
             values,
             log_probs,
             old_log_probs,
@@ -294,26 +308,30 @@ class VPGPolicy:
         losses["total_loss"].backward()
 
         # Log gradient norms
-        logger.info(
-            f"Policy network L2 gradient norm: {self.policy_nn.get_gradient_norm()}"
+        logger.opt(lazy=True).info(
+            "Policy network L2 gradient norm: {}",
+            lambda: self.policy_nn.get_gradient_norm(sync=True),
         )
         if self.baseline_nn is not None:
-            logger.info(
-                f"Baseline network L2 gradient norm: {self.baseline_nn.get_gradient_norm()}"
+            logger.opt(lazy=True).info(
+                "Baseline network L2 gradient norm: {}",
+                lambda: self.baseline_nn.get_gradient_norm(sync=True),
             )
 
         # Clip gradient norms
         if clip_gradient_norm is not None:
             nn.utils.clip_grad_norm_(self.policy_nn.parameters(), clip_gradient_norm)
-            logger.info(
-                f"Policy network L2 gradient norm after clipping: {self.policy_nn.get_gradient_norm()}"
+            logger.opt(lazy=True).info(
+                "Policy network L2 gradient norm after clipping: {}",
+                lambda: self.policy_nn.get_gradient_norm(sync=True),
             )
             if self.baseline_nn is not None:
                 nn.utils.clip_grad_norm_(
                     self.baseline_nn.parameters(), clip_gradient_norm
                 )
-                logger.info(
-                    f"Baseline network L2 gradient norm after clipping: {self.baseline_nn.get_gradient_norm()}"
+                logger.opt(lazy=True).info(
+                    "Baseline network L2 gradient norm after clipping: {}",
+                    lambda: self.baseline_nn.get_gradient_norm(sync=True),
                 )
 
         # Update parameters